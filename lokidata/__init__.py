@@ -1,21 +1,25 @@
+import codecs
+import copy
 import datetime
+import functools
 import logging
 import pathlib
 from typing import (
     Any,
+    Callable,
     Collection,
     Dict,
+    List,
     Mapping,
     Optional,
     Tuple,
     Union,
 )
-from tqdm.auto import tqdm
 import fnmatch
 import os
+import re
+import stat
 from . import _version
-import yaml
-import chardet
 
 
 def _add_note(exc, note: str) -> None:
@@ -24,10 +28,14 @@ def _add_note(exc, note: str) -> None:
             f"Expected a string, got note={note!r} (type {type(note).__name__})"
         )
 
-    if not hasattr(exc, "__notes__"):
-        exc.__notes__ = []
+    try:
+        # Python >= 3.11
+        exc.add_note(note)
+    except AttributeError:
+        if not hasattr(exc, "__notes__"):
+            exc.__notes__ = []
 
-    exc.__notes__.append(note)
+        exc.__notes__.append(note)
 
 
 __version__ = _version.get_versions()["version"]
@@ -40,13 +48,30 @@ NAN = float("nan")
 
 
 def german_float(s: str):
+    if "," in s:
+        s = s.replace(",", ".")
+    elif not s:
+        # Empty fields are common, avoid raising and catching an exception for them
+        return NAN
+
     try:
-        return float(s.replace(",", "."))
+        return float(s)
     except ValueError:
         return NAN
 
 
 def german_date(s: str):
+    # Fast path for the regular DD.MM.YYYY format, strptime is comparatively slow
+    if (
+        len(s) == 10
+        and s.isascii()
+        and s[2] == s[5] == "."
+        and s[:2].isdigit()
+        and s[3:5].isdigit()
+        and s[6:].isdigit()
+    ):
+        return datetime.date(int(s[6:10]), int(s[3:5]), int(s[0:2]))
+
     return datetime.datetime.strptime(s, "%d.%m.%Y").date()
 
 
@@ -136,61 +161,159 @@ LOG_FIELDS = {
 }
 
 
-def _parse_tmd_line(line: str, fields) -> Tuple[str, Any]:
-    try:
-        idx, value = line.rstrip("\n").split(";", 1)
-    except BaseException as exc:
-        _add_note(exc, f"Offending line: {line}")
-        raise exc
+FieldTable = Tuple[Tuple[Optional[str], ...], Tuple[Optional[Callable], ...]]
 
-    name, converter = fields[int(idx)]
-    if converter is not None:
-        try:
-            value = converter(value)
-        except BaseException as exc:
-            _add_note(exc, f"Field {name}")
-            raise exc
 
-    return name, value
+def _field_table(fields: Mapping[int, Tuple[str, Optional[Callable]]]) -> FieldTable:
+    # Lay out a field definition as two tuples indexed by field id, so that
+    # read_dat does not need a dict lookup and tuple unpacking per field
+    names: list = [None] * (max(fields) + 1)
+    converters: list = [None] * (max(fields) + 1)
+    for idx, (name, converter) in fields.items():
+        names[idx] = name
+        converters[idx] = converter
 
+    return tuple(names), tuple(converters)
 
-def _parse_dat_line(idx: int, line: str, fields) -> Tuple[str, Any]:
-    value = line.rstrip("\n")
 
-    name, converter = fields[idx]
+DAT_NAMES, DAT_CONVERTERS = _field_table(DAT_FIELDS)
+
+
+def _split_lines(text: str) -> List[str]:
+    # Like iterating a file in text mode: Only \n, \r\n and \r end a line.
+    # (str.splitlines would also split at e.g. \x0c or \u2028 inside values.)
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    if lines and not lines[-1]:
+        lines.pop()
+
+    return lines
+
+
+def _make_line_parser(
+    fields: Mapping[int, Tuple[str, Optional[Callable]]],
+    remap_fields: Optional[Mapping[str, str]] = None,
+) -> Callable[[str], Dict[str, Any]]:
+    # Build a parser specialized for one field definition.
+    # Fields are looked up by the raw id text, which saves an int() per line.
+    # Only non-canonical ids (e.g. "05") take the slower path.
+    #
+    # With remap_fields ({new key: field name}), values are stored directly under
+    # the new keys and all other fields are skipped.
+    # The table maps the id text to (key, field name, converter).
+    if remap_fields is None:
+        table = {
+            str(idx): (name, name, converter)
+            for idx, (name, converter) in fields.items()
+        }
+        aliases = []
+    else:
+        remap_fields = dict(remap_fields)
+        new_keys: Dict[str, str] = {}
+        aliases = []
+        for key, name in remap_fields.items():
+            if name in new_keys:
+                # The same field under multiple keys, copy after parsing
+                aliases.append((key, new_keys[name]))
+            else:
+                new_keys[name] = key
+
+        table = {
+            str(idx): (new_keys.get(name), name, converter)
+            for idx, (name, converter) in fields.items()
+        }
+
+    def _parse(text: str) -> Dict[str, Any]:
+        data = {}
+        for line in _split_lines(text):
+            # partition returns a fixed 3-tuple and is cheaper than split(";", 1)
+            idx, sep, value = line.partition(";")
+            if not sep:
+                raise ValueError(f"Missing separator. Offending line: {line}")
+
+            field = table.get(idx)
+            if field is None:
+                i = int(idx)
+                field = table.get(str(i))
+                if field is None:
+                    raise KeyError(i)
+
+            key, name, converter = field
+            if key is None:
+                # Not included in remap_fields
+                continue
+
+            if converter is not None:
+                try:
+                    value = converter(value)
+                except (ValueError, KeyError, IndexError) as exc:
+                    _add_note(exc, f"Field {name}")
+                    raise exc
+
+            data[key] = value
+
+        if remap_fields is not None:
+            for key, other_key in aliases:
+                if other_key in data:
+                    data[key] = data[other_key]
+
+            if len(data) < len(remap_fields):
+                for key, name in remap_fields.items():
+                    if key not in data:
+                        raise KeyError(name)
+
+        return data
+
+    return _parse
+
+
+_parse_tmd_text = _make_line_parser(TMD_FIELDS)
+_parse_log_text = _make_line_parser(LOG_FIELDS)
+
+
+def _parse_dat_line(name: str, converter, line: str) -> Tuple[str, Any]:
+    value = line.rstrip("\n")
 
     if converter is not None:
         try:
             value = converter(value)
-        except BaseException as exc:
+        except (ValueError, KeyError, IndexError) as exc:
             _add_note(exc, f"Field {name}")
             raise exc
 
     return name, value
 
 
-def read_tmd(fn: StrOrPath):
-    if isinstance(fn, str):
-        fn = pathlib.Path(fn)
+def _read_text(fn: StrOrPath, strict: bool = False) -> str:
+    with open(fn, "rb") as f:
+        raw = f.read()
 
-    for encoding in ("utf-8", "Windows-1252"):
+    if raw.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return raw.decode("utf-16")
+
+    for encoding in ("utf-8-sig", "Windows-1252"):
         try:
-            with fn.open(encoding=encoding) as f:
-                return dict(_parse_tmd_line(l, TMD_FIELDS) for l in f)
+            return raw.decode(encoding)
         except UnicodeDecodeError:
             pass
 
-    with fn.open("rb") as f:
-        detected = chardet.detect_all(f.read())
+    if strict:
+        import chardet
 
-    raise ValueError(f"Unexpected encoding. Guessed {detected}")
+        detected = chardet.detect_all(raw)
 
+        raise ValueError(f"Unexpected encoding. Guessed {detected}")
 
-def read_dat(fn: StrOrPath):
-    if isinstance(fn, str):
-        fn = pathlib.Path(fn)
+    # Latin-1 maps every byte to a code point, so decoding can not fail
+    logger.warning(f"Unexpected encoding in {fn}, falling back to Latin-1")
+    return raw.decode("latin-1")
+
+
+def read_tmd(fn: StrOrPath, strict: bool = False):
+    return _parse_tmd_text(_read_text(fn, strict))
 
-    with fn.open() as f:
+
+def read_dat(fn: StrOrPath):
+    with open(fn) as f:
         # FIXME: Sometimes, a .dat contains multiple lines.
         # Here, we only use the first one.
         contents = f.readline()
@@ -198,9 +321,9 @@ def read_dat(fn: StrOrPath):
     fields = contents.split("\t")
 
     return dict(
-        _parse_dat_line(i, f, DAT_FIELDS)
-        for i, f in enumerate(fields, 1)
-        if i in DAT_FIELDS
+        _parse_dat_line(DAT_NAMES[i], DAT_CONVERTERS[i], f)
+        for i, f in enumerate(fields[: len(DAT_NAMES) - 1], 1)
+        if DAT_NAMES[i] is not None
     )
 
 
@@ -221,28 +344,56 @@ LOG_FIELDS_TO_ECOTAXA = {
 }
 
 
-def read_log(fn: StrOrPath, remap_fields: Optional[Mapping] = None):
-    if isinstance(fn, str):
-        fn = pathlib.Path(fn)
+def _file_version(fn: StrOrPath) -> Optional[Tuple[int, int, int, int]]:
+    # Identifies a particular version of a regular file, used as a cache key
+    try:
+        st = os.stat(fn)
+    except OSError:
+        return None
 
-    with fn.open() as f:
-        data = dict(_parse_tmd_line(l, LOG_FIELDS) for l in f)
+    if not stat.S_ISREG(st.st_mode):
+        return None
 
-    if remap_fields is not None:
-        data = {ke: data[kl] for ke, kl in remap_fields.items()}
+    return st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns
 
-    return data
 
+@functools.lru_cache(maxsize=None)
+def _make_log_parser(remap_items: Optional[Tuple]) -> Callable[[str], Dict[str, Any]]:
+    if remap_items is None:
+        return _parse_log_text
 
-def read_yaml(fn: StrOrPath) -> Dict[str, Any]:
-    if isinstance(fn, str):
-        fn = pathlib.Path(fn)
+    # Parse and remap in a single pass, e.g. for LOG_FIELDS_TO_ECOTAXA
+    return _make_line_parser(LOG_FIELDS, dict(remap_items))
 
-    if not fn.is_file():
-        return {}
 
-    with fn.open() as f:
-        value = yaml.safe_load(f)
+@functools.lru_cache(maxsize=4096)
+def _read_log_cached(
+    fn: StrOrPath, version, remap_items: Optional[Tuple], strict: bool
+) -> Dict[str, Any]:
+    return _make_log_parser(remap_items)(_read_text(fn, strict))
+
+
+def read_log(
+    fn: StrOrPath, remap_fields: Optional[Mapping] = None, strict: bool = False
+):
+    remap_items = tuple(remap_fields.items()) if remap_fields is not None else None
+
+    # Repeated reads of an unchanged file are served from the cache.
+    # Return a copy so that callers can not modify the cached value.
+    return dict(_read_log_cached(fn, _file_version(fn), remap_items, strict))
+
+
+@functools.lru_cache(maxsize=4096)
+def _read_yaml_cached(fn: StrOrPath, version) -> Dict[str, Any]:
+    # Imported here so that only callers of read_yaml pay for the import
+    import yaml
+
+    # CSafeLoader is only available if PyYAML was built with libyaml
+    loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+    # libyaml decodes the input itself, so the file is opened in binary mode
+    with open(fn, "rb") as f:
+        value = yaml.load(f, Loader=loader)
 
         if not isinstance(value, dict):
             raise ValueError(f"Unexpected content in {fn}: {value}")
@@ -250,24 +401,101 @@ def read_yaml(fn: StrOrPath) -> Dict[str, Any]:
         return value
 
 
-def find_data_roots(project_root: StrOrPath, ignore_patterns: Collection | None = None):
-    if isinstance(project_root, str):
-        project_root = pathlib.Path(project_root)
+def read_yaml(fn: StrOrPath) -> Dict[str, Any]:
+    version = _file_version(fn)
+    if version is None or version[2] == 0:
+        # Missing or empty file
+        return {}
 
-    logger.info(f"Checking {project_root}")
+    # Deep copy, as nested values would otherwise be shared with the cache
+    return copy.deepcopy(_read_yaml_cached(fn, version))
 
-    if ignore_patterns is not None and any(
-        project_root.match(pat) for pat in ignore_patterns
-    ):
-        return
 
-    subdirs = [p for p in project_root.iterdir() if p.is_dir()]
+IgnorePattern = Tuple[bool, Tuple[re.Pattern, ...]]
 
-    if any(p.name == "Pictures" for p in subdirs) and any(
-        p.name == "Telemetrie" for p in subdirs
-    ):
-        yield project_root
 
-    else:
-        for subdir in subdirs:
-            yield from find_data_roots(subdir, ignore_patterns)
+def _compile_ignore_patterns(patterns: Collection) -> List[IgnorePattern]:
+    # Translate each pattern once into (anchored, per-part regexes).
+    # Matching these with _is_ignored behaves like PurePath.match.
+    compiled = []
+    for pattern in patterns:
+        pattern = pathlib.PurePath(pattern)
+        if not pattern.parts:
+            raise ValueError("empty pattern")
+
+        anchored = bool(pattern.drive or pattern.root)
+        regexes = tuple(
+            re.compile(fnmatch.translate(os.path.normcase(part)))
+            for part in pattern.parts
+        )
+        compiled.append((anchored, regexes))
+
+    return compiled
+
+
+def _path_parts(path: str) -> List[str]:
+    # Equivalent to PurePath(path).parts for the normalized paths of the traversal
+    drive, rest = os.path.splitdrive(path)
+    parts = [p for p in rest.split(os.sep) if p and p != "."]
+    if rest.startswith(os.sep):
+        parts.insert(0, drive + os.sep)
+    elif drive:
+        parts.insert(0, drive)
+
+    return [os.path.normcase(p) for p in parts]
+
+
+def _is_ignored(path: str, ignore_patterns: List[IgnorePattern]) -> bool:
+    # Relative patterns match from the right, anchored patterns match the whole path
+    parts = _path_parts(path)
+    for anchored, regexes in ignore_patterns:
+        if len(regexes) > len(parts) or (anchored and len(regexes) != len(parts)):
+            continue
+
+        if all(r.match(p) for r, p in zip(reversed(regexes), reversed(parts))):
+            return True
+
+    return False
+
+
+def _find_data_roots(project_root: str, ignore_patterns: List[IgnorePattern]):
+    # Depth-first traversal with an explicit stack instead of recursive generators.
+    # Subdirectories are pushed in reverse so that they are visited in order.
+    # Paths are handled as plain strings and only converted to Path when yielded.
+    stack = [project_root]
+    while stack:
+        path = stack.pop()
+
+        logger.info("Checking %s", path)
+
+        if ignore_patterns and _is_ignored(path, ignore_patterns):
+            continue
+
+        # A single scandir pass collects the subdirectories and looks for the marker
+        # directories. DirEntry.is_dir only needs an extra stat for symlinks.
+        subdirs = []
+        has_pictures = has_telemetrie = False
+        with os.scandir(path) as it:
+            for entry in it:
+                if entry.is_dir():
+                    if entry.name == "Pictures":
+                        has_pictures = True
+                    elif entry.name == "Telemetrie":
+                        has_telemetrie = True
+                    # Avoid a leading "./", like Path does
+                    subdirs.append(entry.name if path == "." else entry.path)
+
+        if has_pictures and has_telemetrie:
+            yield pathlib.Path(path)
+
+        else:
+            stack.extend(reversed(subdirs))
+
+
+def find_data_roots(project_root: StrOrPath, ignore_patterns: Collection | None = None):
+    # Compile the patterns once instead of for every visited directory.
+    # Path normalizes the root (e.g. "./a//b/" -> "a/b") for the pattern matching.
+    yield from _find_data_roots(
+        str(pathlib.Path(project_root)),
+        _compile_ignore_patterns(ignore_patterns or ()),
+    )
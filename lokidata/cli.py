@@ -1,8 +1,10 @@
+import collections
 import concurrent.futures
-import glob
-import os.path
-import subprocess
-from typing import List
+import functools
+import os
+import threading
+import zipfile
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
 
 import click
 from tqdm.auto import tqdm
@@ -11,6 +13,126 @@ from werkzeug.utils import secure_filename
 from . import LOG_FIELDS_TO_ECOTAXA, find_data_roots, read_log, read_yaml
 
 
+def _find_log(data_root) -> str:
+    # Equivalent to glob("Log/LOKI*.log"), but with a single directory read
+    with os.scandir(os.path.join(data_root, "Log")) as it:
+        log_fns = [
+            e.path for e in it if e.name.startswith("LOKI") and e.name.endswith(".log")
+        ]
+
+    if len(log_fns) != 1:
+        raise ValueError(
+            f"Expected exactly one LOKI*.log in {data_root}, found {len(log_fns)}"
+        )
+
+    return log_fns[0]
+
+
+def _read_sample_meta(data_root) -> Dict[str, Any]:
+    # Read logfile and YAML meta
+    log_fn = _find_log(data_root)
+    yaml_meta_fn = os.path.join(data_root, "meta.yaml")
+    return {
+        **read_log(log_fn, remap_fields=LOG_FIELDS_TO_ECOTAXA),
+        **read_yaml(yaml_meta_fn),
+    }
+
+
+def _iter_sample_meta(
+    executor: concurrent.futures.Executor, data_roots: Iterable
+) -> Iterator[Tuple[Any, Dict[str, Any]]]:
+    # Yield (data_root, meta) in discovery order as soon as the metadata is ready,
+    # so that compression can start while discovery is still running
+    pending: collections.deque = collections.deque()
+    for data_root in data_roots:
+        pending.append((data_root, executor.submit(_read_sample_meta, data_root)))
+
+        while pending and pending[0][1].done():
+            data_root, future = pending.popleft()
+            yield data_root, future.result()
+
+    for data_root, future in pending:
+        yield data_root, future.result()
+
+
+# Storing these avoids a compression pass that would not reduce their size
+STORED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".zip", ".gz", ".bz2", ".xz"}
+
+
+def _raise(exc: BaseException):
+    raise exc
+
+
+class _Cancelled(Exception):
+    pass
+
+
+def _archive(data_root, archive_fn, cancel: threading.Event) -> str:
+    # Write to a temporary file, which the caller renames to archive_fn once the
+    # whole run succeeded, so that an aborted run leaves no (incomplete) archives
+    data_root = os.fspath(data_root)
+    tmp_fn = archive_fn + ".part"
+
+    # Never include the archive itself, e.g. when target_dir is inside data_root
+    skip = {os.path.abspath(archive_fn), os.path.abspath(tmp_fn)}
+
+    try:
+        # strict_timestamps=False clamps mtimes before 1980 instead of failing
+        with zipfile.ZipFile(
+            tmp_fn, "w", allowZip64=True, strict_timestamps=False
+        ) as zf:
+            # Follow symlinked directories like zip -r, and fail instead of silently
+            # leaving out directories that can not be read
+            for dirpath, dirnames, filenames in os.walk(
+                data_root, onerror=_raise, followlinks=True
+            ):
+                dirnames.sort()
+
+                if dirpath != data_root:
+                    # Keep directory entries (like zip -r), so empty directories survive
+                    zf.write(dirpath, os.path.relpath(dirpath, data_root))
+
+                for fn in sorted(filenames):
+                    if cancel.is_set():
+                        raise _Cancelled()
+
+                    path = os.path.join(dirpath, fn)
+                    if os.path.abspath(path) in skip:
+                        continue
+
+                    compress_type = (
+                        zipfile.ZIP_STORED
+                        if os.path.splitext(fn)[1].lower() in STORED_EXTENSIONS
+                        else zipfile.ZIP_DEFLATED
+                    )
+                    try:
+                        zf.write(
+                            path,
+                            os.path.relpath(path, data_root),
+                            compress_type=compress_type,
+                        )
+                    except OSError as exc:
+                        # Skip unreadable entries (e.g. broken symlinks) like zip -r
+                        click.echo(f"Skipping {path}: {exc}", err=True)
+    except BaseException:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+        raise
+
+    return tmp_fn
+
+
+def _report_done(sample_id, future: concurrent.futures.Future):
+    if future.cancelled() or isinstance(future.exception(), _Cancelled):
+        return
+
+    exc = future.exception()
+    if exc is None:
+        print(sample_id, "finished.\n")
+    else:
+        click.echo(f"{sample_id} failed: {exc}", err=True)
+
+
 @click.group()
 def main():
     pass
@@ -34,53 +156,69 @@ def compress(root_dir, n_workers, skip_existing, ignore, target_dir):
         target_dir = root_dir
 
     executor = concurrent.futures.ThreadPoolExecutor(n_workers)
+    cancel = threading.Event()
 
     print("Discovering project directories...")
     futures: List[concurrent.futures.Future] = []
+    archive_fns: Dict[concurrent.futures.Future, str] = {}
     existing_archive_fns = set()
-    tasks = []
-    for data_root in find_data_roots(root_dir, progress=False, ignore_patterns=ignore):
-        # Read logfile and YAML meta
-        (log_fn,) = glob.glob(os.path.join(data_root, "Log", "LOKI*.log"))
-        yaml_meta_fn = os.path.join(data_root, "meta.yaml")
-        meta = {
-            **read_log(log_fn, remap_fields=LOG_FIELDS_TO_ECOTAXA),
-            **read_yaml(yaml_meta_fn),
-        }
-
-        sample_id = "{sample_station}_{sample_haul}".format_map(meta)
-
-        archive_fn = os.path.join(target_dir, secure_filename(sample_id)) + ".zip"
-        print(data_root, "->", archive_fn)
-
-        if archive_fn in existing_archive_fns:
-            click.echo(f"Duplicate target archive filename {archive_fn}", err=True)
-            raise click.Abort()
-
-        existing_archive_fns.add(archive_fn)
-
-        if skip_existing and os.path.isfile(archive_fn):
-            print(archive_fn, "already exists.")
-            continue
-
-        tasks.append(
-            (
-                sample_id,
-                (subprocess.run, ["zip", "-r", archive_fn, "."]),
-                dict(cwd=data_root, check=True, stdout=subprocess.DEVNULL),
-            )
-        )
-
-    print(f"Compressing {len(tasks)} samples...")
-    for sample_id, args, kwargs in tasks:
-        future = executor.submit(*args, **kwargs)
-        future.add_done_callback(
-            lambda _, sample_id=sample_id: print(sample_id, "finished.\n")
-        )
-        futures.append(future)
 
-    for _ in tqdm(concurrent.futures.as_completed(futures), total=len(futures)):
-        pass
+    try:
+        # Read the metadata in worker processes to overlap the log and YAML file I/O
+        with concurrent.futures.ProcessPoolExecutor(n_workers) as meta_executor:
+            for data_root, meta in _iter_sample_meta(
+                meta_executor, find_data_roots(root_dir, ignore_patterns=ignore)
+            ):
+                sample_id = "{sample_station}_{sample_haul}".format_map(meta)
+
+                archive_fn = (
+                    os.path.join(target_dir, secure_filename(sample_id)) + ".zip"
+                )
+                print(data_root, "->", archive_fn)
+
+                if archive_fn in existing_archive_fns:
+                    click.echo(
+                        f"Duplicate target archive filename {archive_fn}", err=True
+                    )
+                    raise click.Abort()
+
+                existing_archive_fns.add(archive_fn)
+
+                if skip_existing and os.path.isfile(archive_fn):
+                    print(archive_fn, "already exists.")
+                    continue
+
+                # Start compressing right away instead of waiting for the discovery
+                future = executor.submit(_archive, data_root, archive_fn, cancel)
+                future.add_done_callback(functools.partial(_report_done, sample_id))
+                futures.append(future)
+                archive_fns[future] = archive_fn
+
+        # Discovery succeeded, so the archives can replace existing ones
+        print(f"Compressing {len(futures)} samples...")
+        n_failed = 0
+        for future in tqdm(
+            concurrent.futures.as_completed(futures), total=len(futures)
+        ):
+            if future.exception() is not None:
+                n_failed += 1
+            else:
+                os.replace(future.result(), archive_fns[future])
+    except BaseException:
+        # Archives are written while discovery is still running. If the run is
+        # aborted (e.g. duplicate archive names or Ctrl-C), stop the running jobs and
+        # remove their temporary files. Existing archives are left untouched.
+        cancel.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                tmp_fn = future.result()
+                if os.path.isfile(tmp_fn):
+                    os.remove(tmp_fn)
+        raise
+
+    if n_failed:
+        raise click.ClickException(f"{n_failed} of {len(futures)} archives failed.")
 
     print("All done.")
 
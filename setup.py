@@ -22,10 +22,11 @@ setup(
         "werkzeug",
         "exceptiongroup",
         "tqdm",
-        "chardet",
     ],
     python_requires=">=3.7",
     extras_require={
+        # Guess the encoding of unreadable files with read_tmd(..., strict=True)
+        "strict": ["chardet"],
         "test": [
             # Pytest
             "pytest",
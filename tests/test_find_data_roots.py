@@ -0,0 +1,88 @@
+import os
+import pathlib
+
+import pytest
+
+from lokidata import _compile_ignore_patterns, _is_ignored, find_data_roots
+
+PATTERNS = [
+    "old",
+    "*old",
+    "o?d",
+    "[a-o]ld",
+    "[!x]ld",
+    "[z-a]",
+    "[]x]",
+    "[!]x]",
+    "[",
+    "x/*",
+    "*/s1",
+    "/tmp/fx/*",
+    "/tmp/*/p",
+    "*",
+    ".*",
+    "*.*",
+    "a/b/c/d/e",
+    "p/*/s2",
+    "**/s2",
+]
+
+PATHS = [
+    "/tmp/fx/p/old",
+    "/tmp/fx/p/bold",
+    "/tmp/fx/p",
+    "/tmp/fx/p/x/s1",
+    "/tmp/fx/p/y/z/s2",
+    "/x",
+    "old",
+    "x/s1",
+    "]x",
+    "a",
+    "/tmp/fx/p/.hidden",
+    "/tmp/fx/p/x.y",
+    ".",
+]
+
+
+@pytest.mark.parametrize("pattern", PATTERNS)
+@pytest.mark.parametrize("path", PATHS)
+def test_is_ignored_matches_purepath(pattern, path):
+    path = str(pathlib.Path(path))
+    expected = pathlib.PurePath(path).match(pattern)
+
+    assert _is_ignored(path, _compile_ignore_patterns([pattern])) == expected
+
+
+def test_empty_pattern():
+    with pytest.raises(ValueError):
+        _compile_ignore_patterns([""])
+
+
+def _make_sample(path: pathlib.Path):
+    for name in ("Pictures", "Telemetrie", "Log"):
+        (path / name).mkdir(parents=True)
+
+
+def test_find_data_roots(tmp_path: pathlib.Path):
+    for sample in ("x/s1", "y/z/s2", "old/s3"):
+        _make_sample(tmp_path / sample)
+
+    assert list(find_data_roots(tmp_path)) == [
+        tmp_path / "x" / "s1",
+        tmp_path / "y" / "z" / "s2",
+        tmp_path / "old" / "s3",
+    ]
+
+    assert list(find_data_roots(str(tmp_path), ["old", "y/*"])) == [
+        tmp_path / "x" / "s1",
+    ]
+
+
+def test_find_data_roots_cwd(tmp_path: pathlib.Path, monkeypatch):
+    _make_sample(tmp_path / "x" / "s1")
+    monkeypatch.chdir(tmp_path)
+
+    # "." itself is never matched, like PurePath(".").match(".*")
+    assert list(find_data_roots(".", [".*"])) == [pathlib.Path("x", "s1")]
+    # Children of "." have no "./" prefix, so "*/*/s1" is longer than "x/s1"
+    assert list(find_data_roots(os.curdir, ["*/*/s1"])) == [pathlib.Path("x", "s1")]
@@ -0,0 +1,108 @@
+import datetime
+import math
+
+import pytest
+
+from lokidata import LOG_FIELDS_TO_ECOTAXA, read_log, read_tmd
+
+LOG = """1;01.02.2020
+2;12:30:45
+3;17
+4;LOKI-1
+5;0042
+8;PS122
+9;St1
+10;5
+11;H1
+12;Me
+13;Polarstern
+17;1
+18;12,5
+19;-80,5
+61;a\x0cb
+"""
+
+
+@pytest.fixture
+def log_fn(tmp_path):
+    fn = tmp_path / "LOKI_1.log"
+    fn.write_text(LOG, encoding="utf-8")
+    return fn
+
+
+def test_read_log(log_fn):
+    data = read_log(log_fn)
+
+    assert data["DATE"] == datetime.date(2020, 2, 1)
+    assert data["TIME"] == datetime.time(12, 30, 45)
+    assert data["PICTURE#"] == 17
+    assert data["FIX_LON"] == 12.5
+    assert data["FIX_LAT"] == -80.5
+    # Only real newlines end a line
+    assert data["ERROR"] == "a\x0cb"
+
+
+def test_read_log_remap(log_fn):
+    data = read_log(log_fn, remap_fields=LOG_FIELDS_TO_ECOTAXA)
+
+    assert set(data) == set(LOG_FIELDS_TO_ECOTAXA)
+    assert data["sample_date"] == datetime.date(2020, 2, 1)
+    assert data["sample_station"] == "St1"
+    assert data["sample_latitude"] == -80.5
+
+
+def test_read_log_remap_alias(log_fn):
+    data = read_log(log_fn, remap_fields={"a": "DATE", "b": "DATE", "c": "HAUL"})
+
+    assert data == {
+        "a": datetime.date(2020, 2, 1),
+        "b": datetime.date(2020, 2, 1),
+        "c": "H1",
+    }
+
+
+def test_read_log_remap_missing_field(log_fn):
+    with pytest.raises(KeyError, match="STOP_DATE"):
+        read_log(log_fn, remap_fields={"sample_stop_date": "STOP_DATE"})
+
+
+def test_read_log_converter_note(tmp_path):
+    fn = tmp_path / "LOKI_1.log"
+    fn.write_text("1;xx.02.2020\n")
+
+    # The note names the LOG field, also when remapping
+    for remap_fields in (None, {"sample_date": "DATE"}):
+        with pytest.raises(ValueError) as excinfo:
+            read_log(fn, remap_fields=remap_fields)
+
+        assert excinfo.value.__notes__ == ["Field DATE"]
+
+
+def test_read_log_unknown_id(tmp_path):
+    fn = tmp_path / "LOKI_1.log"
+    fn.write_text("1;01.02.2020\n99;foo\n")
+
+    with pytest.raises(KeyError, match="99"):
+        read_log(fn)
+
+
+def test_read_tmd(tmp_path):
+    fn = tmp_path / "a.tmd"
+    fn.write_bytes("1;LOKI-1\r\n05;12,5\r\n10;\r\n231;42\r\n240;°C\r\n".encode("cp1252"))
+
+    data = read_tmd(fn)
+
+    assert data["DEVICE"] == "LOKI-1"
+    # Non-canonical id
+    assert data["GPS_LON"] == 12.5
+    assert math.isnan(data["PRESS"])
+    assert data["LOKI_PIC"] == 42
+    assert data["HOUSE_STAT"] == "°C"
+
+
+def test_read_tmd_missing_separator(tmp_path):
+    fn = tmp_path / "a.tmd"
+    fn.write_text("1;LOKI-1\nfoo\n")
+
+    with pytest.raises(ValueError, match="foo"):
+        read_tmd(fn)